@@ -3,55 +3,513 @@ This script identifies duplicate and invalid files from a directory and removes
 """
 
 from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils import progressBar
 import hashlib
 import argparse
+import mmap
+import multiprocessing
 import os
+import secrets
+import sqlite3
+import sys
+import threading
+
+# Optional faster hash algorithms
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+READ_BUFFERS = threading.local()
+FADVISE_SUPPORTED = hasattr(os, 'posix_fadvise')
+HASH_ALGORITHM = 'blake3' if blake3 is not None else 'xxh3_128' if xxhash is not None else 'md5'
 
 # Formatters
 NO_DUPLICATES_MSG = 'No Duplicate Files Found'
 INVALID_FILES_DETECTED_MSG = 'Invalid Files Detected:'
 REMOVING_INVALID_FILES_MSG = 'Removing invalid files...'
 REMOVING_DUPLICATE_FILES_MSG = "Removing Duplicate Files..."
+LINKING_DUPLICATE_FILES_MSG = 'Replacing Duplicate Files with Hardlinks...'
 GETTING_FILES_MSG = 'Getting files from: "{}"'
 BLUE_BOLD_UNDERLINE_ANSI = '\033[1;4m'
 RED_BOLD_ANSI = '\033[31;49;1m'
 STOP_ESCAPE_ANSI = '\033[0m'
 
 # Default Values
-FILE_SIZE_INDEX = 6
-FILE_MTIME_INDEX = 8
+HASH_CHUNK_SIZE = 1 << 20  # 1 MiB
+PARTIAL_HASH_SIZE = 1 << 16  # 64 KiB
+HASH_WORKERS = min(32, (os.cpu_count() or 4) * 4)
+PROCESS_POOL_THRESHOLD = 1 << 30  # 1 GiB
+MAX_PROCESS_CHUNK_SIZE = 64
+MAX_THREAD_BATCH_SIZE = 16
+SEGMENTED_HASH_THRESHOLD = 1 << 30  # 1 GiB
+HASH_SEGMENT_SIZE = 1 << 26  # 64 MiB
+SEGMENTED_HASH_TAG = 'segmented-{}m:'.format(HASH_SEGMENT_SIZE >> 20)
+FILE_OPERATION_WORKERS = 8
+CACHE_FILE_NAME = '.dupfinder_cache.sqlite'
+CACHE_FILE_SUFFIXES = ['', '-wal', '-shm', '-journal']
+XATTR_HASH_NAME = 'user.dupfinder.' + HASH_ALGORITHM
+XATTR_MTIME_NAME = 'user.dupfinder.mtime'
+HARDLINK_TEMP_SUFFIX = '.dedup.tmp'
+HARDLINK_TEMP_ATTEMPTS = 100
+CONFIRMATION_REPLIES = ['y', 'n', 'A', 'Q']
 
 # Messages
 CANCELLED_BY_USER_MSG = 'File deletion cancelled by user: {}'
-DELETE_CONFIRMATION_MSG = 'Are you sure you want to delete {} ([y]es, [n]o)'
+LINK_CANCELLED_BY_USER_MSG = 'File linking cancelled by user: {}'
+DELETE_CONFIRMATION_MSG = 'Are you sure you want to delete {} ([y]es, [n]o, [A]ll, [Q]uit)'
+LINK_CONFIRMATION_MSG = 'Are you sure you want to replace {} with a hardlink ([y]es, [n]o, [A]ll, [Q]uit)'
 SUCCESSFULLY_REMOVED_MSG = 'Successfully removed: {}'
+SUCCESSFULLY_LINKED_MSG = 'Successfully linked: {} -> {}'
+DIFFERENT_FILESYSTEM_MSG = 'Skipped, cannot hardlink across filesystems: {}'
+DIFFERENT_METADATA_MSG = 'Skipped, permissions or owner differ from the linked file: {}'
 
 # Error Messages
 DIRECTORY_IS_EMPTY_MSG = 'Directory is empty'
 ERROR_PATH_NOT_FOUND_MSG = 'ERROR: Path not found, '
 INVALID_DIRECTORY_MSG = 'ERROR: Expected a directory but received a file, '
 EMPTY_DIRECTORY_MSG = 'ERROR: Received empty directory'
+FAILED_TO_REMOVE_MSG = 'ERROR: Failed to remove {}: {}'
+FAILED_TO_LINK_MSG = 'ERROR: Failed to link {}: {}'
+CACHE_UNAVAILABLE_MSG = 'WARNING: Hash cache unavailable, continuing without it: {}'
 
 
 # Helper Functions
-def valid_file(file_entry: os.DirEntry):
+def valid_file(file_size: int):
     """
     Validate file by its size
-    :param file_entry: DirEntry
+    :param file_size: int
     :return: bool
     """
-    return file_entry.stat()[FILE_SIZE_INDEX] > 0
+    return file_size > 0
 
 
-def get_hash(_filepath: str):
+def new_hash():
     """
-    Get the MD5 hash of a file
+    Create a hash object using the fastest available algorithm, BLAKE3, XXH3 then MD5
+    :return: hash object
+    """
+    if blake3 is not None:
+        return blake3.blake3()
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.md5()
+
+
+def get_read_buffer():
+    """
+    Get the read buffer of the current thread, reused across files to avoid allocating per read
+    :return: memoryview
+    """
+    if not hasattr(READ_BUFFERS, 'buffer'):
+        READ_BUFFERS.buffer = memoryview(bytearray(HASH_CHUNK_SIZE))
+    return READ_BUFFERS.buffer
+
+
+def read_hash(_file, _filepath: str, _size: int = None):
+    """
+    Get the hash of an open file, memory mapped when hashing the whole file, otherwise read in chunks
+    :param _file: unbuffered binary file object
+    :param _filepath: str
+    :param _size: int, only hash the first _size bytes if provided
+    :return: str
+    """
+    if blake3 is not None and _size is None:
+        # BLAKE3 can hash a memory mapped file using multiple threads
+        return blake3.blake3(max_threads=blake3.blake3.AUTO).update_mmap(_filepath).hexdigest()
+
+    file_hash = new_hash()
+    remaining = _size
+
+    if _size is None:
+        mapped_file = None
+        # Empty files cannot be memory mapped
+        if os.fstat(_file.fileno()).st_size > 0:
+            try:
+                mapped_file = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Filesystem does not support memory mapping, read the file instead
+                pass
+
+        if mapped_file is not None:
+            # Hash the mapped pages directly instead of copying the file into Python objects
+            with mapped_file:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+                file_hash.update(mapped_file)
+            return file_hash.hexdigest()
+
+    buffer = get_read_buffer()
+    while remaining is None or remaining > 0:
+        read_size = _file.readinto(buffer if remaining is None else buffer[:min(HASH_CHUNK_SIZE, remaining)])
+        if not read_size:
+            break
+        file_hash.update(buffer[:read_size])
+        if remaining is not None:
+            remaining -= read_size
+    return file_hash.hexdigest()
+
+
+def get_segment_hash(_filepath: str, _offset: int):
+    """
+    Get the raw digest of a single segment of a file
+    :param _filepath: str
+    :param _offset: int, start of the segment
+    :return: bytes
+    """
+    segment_hash = new_hash()
+    buffer = get_read_buffer()
+    remaining = HASH_SEGMENT_SIZE
+    with open(_filepath, 'rb', buffering=0) as file:
+        if FADVISE_SUPPORTED:
+            os.posix_fadvise(file.fileno(), _offset, HASH_SEGMENT_SIZE, os.POSIX_FADV_SEQUENTIAL)
+
+        file.seek(_offset)
+        while remaining > 0:
+            read_size = file.readinto(buffer[:min(HASH_CHUNK_SIZE, remaining)])
+            if not read_size:
+                break
+            segment_hash.update(buffer[:read_size])
+            remaining -= read_size
+
+        # Segments are only read once, drop their pages to avoid polluting the page cache
+        if FADVISE_SUPPORTED:
+            os.posix_fadvise(file.fileno(), _offset, HASH_SEGMENT_SIZE, os.POSIX_FADV_DONTNEED)
+    return segment_hash.digest()
+
+
+def segmented_hash_applies(_file_size: int):
+    """
+    Check if a file is large enough to be hashed in segments, only MD5 is bound to a single stream
+    :param _file_size: int
+    :return: bool
+    """
+    return HASH_ALGORITHM == 'md5' and _file_size > SEGMENTED_HASH_THRESHOLD
+
+
+def get_segmented_hash(_filepath: str, _file_size: int, _workers: int):
+    """
+    Get the hash of a large file by hashing its segments in parallel and hashing the combined segment digests.
+    The result is tagged so it is never compared against a plain hash
+    :param _filepath: str
+    :param _file_size: int
+    :param _workers: int, number of threads hashing segments
+    :return: str
+    """
+    offsets = range(0, _file_size, HASH_SEGMENT_SIZE)
+    with ThreadPoolExecutor(max_workers=min(len(offsets), _workers)) as executor:
+        segment_digests = list(executor.map(lambda offset: get_segment_hash(_filepath, offset), offsets))
+
+    file_hash = new_hash()
+    file_hash.update(b''.join(segment_digests))
+    return SEGMENTED_HASH_TAG + file_hash.hexdigest()
+
+
+def get_hash(_filepath: str, _size: int = None):
+    """
+    Get the hash of a file, advising the kernel that it is read sequentially and only once
     :param _filepath: str
+    :param _size: int, only hash the first _size bytes if provided
     :return: str
     """
-    with open(_filepath, 'rb') as file:
-        return hashlib.md5(file.read()).hexdigest()
+    with open(_filepath, 'rb', buffering=0) as file:
+        # Only full hashes read past the first block, a partial hash should not trigger larger readahead
+        if FADVISE_SUPPORTED and _size is None:
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        file_hash = read_hash(file, _filepath, _size)
+
+        # Full hashes are the last read of a file, drop its pages to avoid polluting the page cache
+        if FADVISE_SUPPORTED and _size is None:
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return file_hash
+
+
+def get_batch_hashes(_filepaths: list[str], _size: int = None):
+    """
+    Get the hashes of a batch of files in a single task
+    :param _filepaths: list[str]
+    :param _size: int, only hash the first _size bytes of each file if provided
+    :return: list[str]
+    """
+    return [get_hash(file_path, _size) for file_path in _filepaths]
+
+
+def get_indexed_hash(_args: tuple[int, str, int]):
+    """
+    Get the hash of a file along with its index, used by the process pool
+    :param _args: tuple[int, str, int], index, file path and size passed to get_hash
+    :return: tuple[int, str]
+    """
+    index, file_path, size = _args
+    return index, get_hash(file_path, size)
+
+
+def get_hashes(_filepaths: list[str], _size: int = None, _prefix: str = 'Getting File Hashes:',
+               _workers: int = None, _use_processes: bool = False):
+    """
+    Get the hashes of multiple files using a thread pool, or a process pool when hashing is CPU bound
+    :param _filepaths: list[str]
+    :param _size: int, only hash the first _size bytes of each file if provided
+    :param _prefix: str, progress bar prefix
+    :param _workers: int, number of workers, defaults to the pool's own default
+    :param _use_processes: bool
+    :return: list[str], hashes in the same order as _filepaths
+    """
+    _hashes = [None] * len(_filepaths)
+
+    if _use_processes:
+        workers = _workers or os.cpu_count() or 1
+        # Batch files per task to amortize IPC overhead without starving workers
+        chunk_size = max(1, min(MAX_PROCESS_CHUNK_SIZE, len(_filepaths) // (workers * 4)))
+        tasks = [(index, path, _size) for index, path in enumerate(_filepaths)]
+        with multiprocessing.Pool(workers) as pool:
+            try:
+                for index, file_hash in progressBar(pool.imap_unordered(get_indexed_hash, tasks,
+                                                                        chunksize=chunk_size),
+                                                    prefix=_prefix, suffix='Complete', length=50, total=len(tasks)):
+                    _hashes[index] = file_hash
+            except BaseException:
+                # Stop the workers on interrupt or error instead of finishing the queued tasks
+                pool.terminate()
+                raise
+        return _hashes
+
+    # Submit files in batches to cut per file future and progress bar overhead
+    workers = _workers or HASH_WORKERS
+    batch_size = max(1, min(MAX_THREAD_BATCH_SIZE, len(_filepaths) // (workers * 4)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            futures = {executor.submit(get_batch_hashes, _filepaths[start:start + batch_size], _size): start
+                       for start in range(0, len(_filepaths), batch_size)}
+            for future in progressBar(as_completed(futures), prefix=_prefix, suffix='Complete', length=50,
+                                      total=len(futures)):
+                start = futures[future]
+                _hashes[start:start + batch_size] = future.result()
+        except BaseException:
+            # Cancel queued batches on interrupt or error instead of waiting for all of them
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+    return _hashes
+
+
+def open_hash_cache(_cache_path: str):
+    """
+    Open the persistent hash cache, creating it if needed
+    :param _cache_path: str
+    :return: sqlite3.Connection
+    """
+    connection = sqlite3.connect(_cache_path, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS cache ('
+                       'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, algorithm TEXT, digest TEXT)')
+    return connection
+
+
+def get_cached_hash(_cache: sqlite3.Connection, _filepath: str, _file_size: int, _mtime_ns: int):
+    """
+    Get the cached hash of a file if it has not changed since it was hashed
+    :param _cache: sqlite3.Connection
+    :param _filepath: str
+    :param _file_size: int
+    :param _mtime_ns: int
+    :return: str or None
+    """
+    row = _cache.execute('SELECT digest FROM cache WHERE path=? AND size=? AND mtime_ns=? AND algorithm=?',
+                         (_filepath, _file_size, _mtime_ns, HASH_ALGORITHM)).fetchone()
+    return row[0] if row else None
+
+
+def prune_hash_cache(_cache_path: str, _file_paths: list[str]):
+    """
+    Remove the cached hashes of files that were removed or replaced
+    :param _cache_path: str
+    :param _file_paths: list[str]
+    """
+    if not _file_paths:
+        return
+    cache_directory = os.path.dirname(os.path.abspath(_cache_path))
+    try:
+        cache = open_hash_cache(_cache_path)
+        try:
+            cache.executemany('DELETE FROM cache WHERE path=?',
+                              [(os.path.relpath(file_path, cache_directory),) for file_path in _file_paths])
+        finally:
+            cache.close()
+    except sqlite3.Error as error:
+        print(RED_BOLD_ANSI + CACHE_UNAVAILABLE_MSG.format(error) + STOP_ESCAPE_ANSI)
+
+
+def get_xattr_hash(_filepath: str, _mtime_ns: int):
+    """
+    Get the hash stored in a file's extended attributes if it has not been modified since
+    :param _filepath: str
+    :param _mtime_ns: int
+    :return: str or None
+    """
+    try:
+        if int(os.getxattr(_filepath, XATTR_MTIME_NAME)) != _mtime_ns:
+            return None
+        return os.getxattr(_filepath, XATTR_HASH_NAME).decode()
+    except (OSError, ValueError):
+        # Attribute missing or not supported by the filesystem
+        return None
+
+
+def set_xattr_hash(_filepath: str, _mtime_ns: int, _file_hash: str):
+    """
+    Store the hash of a file in its extended attributes, ignoring filesystems that do not support them
+    :param _filepath: str
+    :param _mtime_ns: int
+    :param _file_hash: str
+    """
+    try:
+        os.setxattr(_filepath, XATTR_HASH_NAME, _file_hash.encode())
+        os.setxattr(_filepath, XATTR_MTIME_NAME, str(_mtime_ns).encode())
+    except OSError:
+        pass
+
+
+def confirm_files(_file_paths: list[str], _confirmation_msg: str = DELETE_CONFIRMATION_MSG,
+                  _cancelled_msg: str = CANCELLED_BY_USER_MSG):
+    """
+    Prompt user for confirmation before removing or replacing each file, [A]ll and [Q]uit answer for the remaining files
+    :param _file_paths: list[str]
+    :param _confirmation_msg: str
+    :param _cancelled_msg: str
+    :return: list[str], confirmed file paths
+    """
+    _confirmed_paths = []
+    for index, file_path in enumerate(_file_paths):
+        res = input(_confirmation_msg.format(BLUE_BOLD_UNDERLINE_ANSI + file_path + STOP_ESCAPE_ANSI))
+        while res not in CONFIRMATION_REPLIES:
+            # Check for valid reply
+            res = input(_confirmation_msg.format(BLUE_BOLD_UNDERLINE_ANSI + file_path + STOP_ESCAPE_ANSI))
+
+        if res == 'A':
+            _confirmed_paths += _file_paths[index:]
+            break
+        if res == 'Q':
+            sys.stdout.write(''.join(_cancelled_msg.format(path) + '\n' for path in _file_paths[index:]))
+            break
+
+        if res == 'y':
+            _confirmed_paths.append(file_path)
+        else:
+            print(_cancelled_msg.format(file_path))
+    return _confirmed_paths
+
+
+def run_file_operations(_operation, _arguments: list[tuple], _prefix: str, _succeeded: list, _failed: list):
+    """
+    Run a file operation for each set of arguments using a thread pool. On interrupt the queued operations are
+    cancelled, and every operation that already ran is still recorded
+    :param _operation: callable
+    :param _arguments: list[tuple], arguments of each call
+    :param _prefix: str, progress bar prefix
+    :param _succeeded: list, filled with the arguments of successful calls
+    :param _failed: list, filled with the arguments and OSError of failed calls
+    """
+    futures = {}
+    unexpected_errors = []
+    try:
+        with ThreadPoolExecutor(max_workers=FILE_OPERATION_WORKERS) as executor:
+            try:
+                for arguments in _arguments:
+                    futures[executor.submit(_operation, *arguments)] = arguments
+                for _ in progressBar(as_completed(futures), prefix=_prefix, suffix='Complete', length=50,
+                                     total=len(futures)):
+                    pass
+            except BaseException:
+                # Stop queued operations, only the ones already running complete
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        for future, arguments in futures.items():
+            if not future.done() or future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                _succeeded.append(arguments)
+            elif isinstance(error, OSError):
+                _failed.append((arguments, error))
+            else:
+                unexpected_errors.append(error)
+
+    if unexpected_errors:
+        raise unexpected_errors[0]
+
+
+def remove_files(_file_paths: list[str], _prefix: str):
+    """
+    Remove files using a thread pool, reporting every removal and failure even if interrupted
+    :param _file_paths: list[str]
+    :param _prefix: str, progress bar prefix
+    :return: list[str], removed files
+    """
+    _removed = []
+    _failed_removals = []
+    try:
+        run_file_operations(os.remove, [(file_path,) for file_path in _file_paths], _prefix, _removed,
+                            _failed_removals)
+    finally:
+        # Buffer output into a single write
+        sys.stdout.write(''.join(SUCCESSFULLY_REMOVED_MSG.format(file_path) + '\n' for (file_path,) in _removed))
+        sys.stdout.write(''.join(RED_BOLD_ANSI + FAILED_TO_REMOVE_MSG.format(file_path, error) + STOP_ESCAPE_ANSI + '\n'
+                                 for (file_path,), error in _failed_removals))
+    return [file_path for (file_path,) in _removed]
+
+
+def link_file(_source_path: str, _file_path: str):
+    """
+    Atomically replace a file with a hardlink to the source file
+    :param _source_path: str
+    :param _file_path: str
+    """
+    # Link to a unique temporary name next to the file, retrying if the name is taken
+    for _ in range(HARDLINK_TEMP_ATTEMPTS):
+        temp_path = '{}.{}{}'.format(_file_path, secrets.token_hex(4), HARDLINK_TEMP_SUFFIX)
+        try:
+            os.link(_source_path, temp_path)
+            break
+        except FileExistsError:
+            continue
+    else:
+        raise FileExistsError('No free temporary name for {}'.format(_file_path))
+
+    try:
+        os.replace(temp_path, _file_path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+
+def link_files(_links: list[tuple[str, str]], _prefix: str):
+    """
+    Replace files with hardlinks using a thread pool, reporting every link and failure even if interrupted
+    :param _links: list[tuple[str, str]], source and file path pairs
+    :param _prefix: str, progress bar prefix
+    :return: list[str], replaced files
+    """
+    _linked = []
+    _failed_links = []
+    try:
+        run_file_operations(link_file, _links, _prefix, _linked, _failed_links)
+    finally:
+        # Buffer output into a single write
+        sys.stdout.write(''.join(SUCCESSFULLY_LINKED_MSG.format(file_path, source_path) + '\n'
+                                 for source_path, file_path in _linked))
+        sys.stdout.write(''.join(RED_BOLD_ANSI + FAILED_TO_LINK_MSG.format(file_path, error) + STOP_ESCAPE_ANSI + '\n'
+                                 for (_, file_path), error in _failed_links))
+    return [file_path for _, file_path in _linked]
 
 
 # Main Functions
@@ -70,7 +528,20 @@ def get_args():
     parser.add_argument('--confirmation', '-c', action='store_true', default=False,
                         help='Use this flag to provide a confirmation message everytime the script attempts to delete '
                              'a file')
-    return parser.parse_args()
+    parser.add_argument('--hardlink', action='store_true', default=False,
+                        help='Use this flag to replace duplicate files with hardlinks to the first file instead of '
+                             'deleting them')
+    parser.add_argument('--cache', action='store_true', default=False,
+                        help='Use this flag to keep a cache of file hashes in the directory to speed up later runs')
+    parser.add_argument('--xattr', action='store_true', default=False,
+                        help='Use this flag to store file hashes in extended attributes to speed up later runs '
+                             '(Linux only)')
+    parser.add_argument('--workers', '-w', type=int, default=None,
+                        help='Number of workers used to hash files, defaults to a value based on the CPU count')
+    args = parser.parse_args()
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+    return args
 
 
 def valid_arguments(_directory: str):
@@ -97,55 +568,156 @@ def valid_arguments(_directory: str):
     return True
 
 
-def get_files(_directory: str, _recursive: bool):
+def iter_files(_directory: str, _recursive: bool) -> Iterator[os.DirEntry]:
     """
-    Get all files in provided directory
+    Iterate over all files in provided directory without following symlinks
     :param _directory: str
     :param _recursive: bool
-    :return: List[DirEntry]
+    :return: Iterator[DirEntry]
     """
-    print(GETTING_FILES_MSG.format(_directory))
-    _file_entries = []
-
-    # List all files in directory
-    dir_entry = os.scandir(_directory)
-
-    # Validate files exist in directory
-    if not dir_entry:
-        print(RED_BOLD_ANSI + DIRECTORY_IS_EMPTY_MSG, directory)
-
-    # Iterate through all the directories
-    for entry in dir_entry:
-        # Check if it's a file or directory
-        if entry.is_file():
-            _file_entries.append(entry)
-        elif entry.is_dir() and _recursive:
-            _file_entries += get_files(entry.path, _recursive)
-
-    return _file_entries
-
-
-def get_duplicates(_file_entries: list[os.DirEntry]):
+    directories = [_directory]
+    while directories:
+        current_directory = directories.pop()
+        print(GETTING_FILES_MSG.format(current_directory))
+
+        # Iterate through the directory, queueing subdirectories instead of recursing
+        with os.scandir(current_directory) as dir_entries:
+            for entry in dir_entries:
+                # Check if it's a file or directory
+                if entry.is_file(follow_symlinks=False):
+                    yield entry
+                elif _recursive and entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+
+
+def get_duplicates(_file_entries: Iterable[os.DirEntry], _workers: int = None, _cache_path: str = None,
+                   _use_xattr: bool = False):
     """
     Get all duplicate files in provided directory
-    :param: _file_entries: list[os.DirEntry]
+    :param: _file_entries: Iterable[os.DirEntry]
+    :param: _workers: int, number of workers used to hash files
+    :param: _cache_path: str, path of the persistent hash cache, disabled if not provided
+    :param: _use_xattr: bool, read and store hashes in the files' extended attributes
     :return: bool
     """
+    # Keep only the metadata needed as parallel lists instead of holding on to DirEntry objects
+    paths, sizes, mtimes = [], [], []
+    for entry in _file_entries:
+        file_stat = entry.stat()
+        paths.append(entry.path)
+        sizes.append(file_stat.st_size)
+        mtimes.append(file_stat.st_mtime_ns)
+
+    # Validate files exist in directory
+    if not paths:
+        print(RED_BOLD_ANSI + DIRECTORY_IS_EMPTY_MSG + STOP_ESCAPE_ANSI)
+        return [], []
+
+    # Open the hash cache before any hashing so an unusable cache does not waste the work
+    cache = None
+    if _cache_path:
+        try:
+            cache = open_hash_cache(_cache_path)
+        except sqlite3.Error as error:
+            print(RED_BOLD_ANSI + CACHE_UNAVAILABLE_MSG.format(error) + STOP_ESCAPE_ANSI)
+
     # Sort files by modified time
-    _file_entries.sort(key=lambda entry: entry.stat()[FILE_MTIME_INDEX])
+    order = sorted(range(len(paths)), key=mtimes.__getitem__)
+    paths = [paths[index] for index in order]
+    sizes = [sizes[index] for index in order]
+    mtimes = [mtimes[index] for index in order]
 
     # Filter invalid files
-    _invalid_files = [entry.path for entry in progressBar(_file_entries,
-                                                          prefix='Identifying Invalid Files:',
-                                                          suffix='Complete',
-                                                          length=50) if not valid_file(entry)]
-
-    # Get file hashes
+    _invalid_files = [file_path for file_path, file_size in progressBar(zip(paths, sizes),
+                                                                        prefix='Identifying Invalid Files:',
+                                                                        suffix='Complete',
+                                                                        length=50,
+                                                                        total=len(paths)) if not valid_file(file_size)]
+
+    # Group files by size, only files sharing a size can be duplicates
+    size_dict = defaultdict(list)
+    for index, file_size in enumerate(sizes):
+        size_dict[file_size].append(index)
+    _candidates = [index for indices in size_dict.values() if len(indices) > 1 for index in indices]
+
+    # Reuse cached full hashes of unchanged files before reading any of them
+    # Files covered by the partial hash are never fully hashed, so they are never cached
+    # Cache paths are relative to the cache's directory so they do not depend on the working directory
+    _cacheable = [index for index in _candidates if sizes[index] > PARTIAL_HASH_SIZE]
+    cache_keys = {}
+    if cache is not None:
+        cache_directory = os.path.dirname(os.path.abspath(_cache_path))
+        cache_keys = {index: os.path.relpath(paths[index], cache_directory) for index in _cacheable}
+    # The hashing scheme depends only on the file size so hashes stay stable across runs
+    _segmented = {index for index in _cacheable if segmented_hash_applies(sizes[index])}
+
+    file_hashes = {}
+    for index in _cacheable:
+        cached_hash = None
+        if cache is not None:
+            cached_hash = get_cached_hash(cache, cache_keys[index], sizes[index], mtimes[index])
+        if cached_hash is None and _use_xattr:
+            cached_hash = get_xattr_hash(paths[index], mtimes[index])
+        # Ignore cached hashes of the other scheme so same sized files stay comparable
+        if cached_hash is not None and cached_hash.startswith(SEGMENTED_HASH_TAG) == (index in _segmented):
+            file_hashes[index] = cached_hash
+
+    # Size groups that are entirely cached skip partial hashing
     hash_dict = defaultdict(list)
-    [hash_dict[get_hash(entry.path)].append(entry.path) for entry in progressBar(_file_entries,
-                                                                                 prefix='Getting File Hashes:',
-                                                                                 suffix='Complete',
-                                                                                 length=50)]
+    _partial_candidates = []
+    for indices in size_dict.values():
+        if len(indices) < 2:
+            continue
+        if all(index in file_hashes for index in indices):
+            for index in indices:
+                hash_dict[file_hashes[index]].append(paths[index])
+        else:
+            _partial_candidates.extend(indices)
+
+    # Group same sized files by the hash of their first block
+    partial_hash_dict = defaultdict(list)
+    _partial_hashes = get_hashes([paths[index] for index in _partial_candidates], PARTIAL_HASH_SIZE,
+                                 'Getting Partial File Hashes:', _workers)
+    for index, partial_hash in zip(_partial_candidates, _partial_hashes):
+        if sizes[index] <= PARTIAL_HASH_SIZE:
+            # Partial hash already covers the whole file
+            hash_dict[partial_hash].append(paths[index])
+        else:
+            partial_hash_dict[(sizes[index], partial_hash)].append(index)
+    _candidates = [index for indices in partial_hash_dict.values() if len(indices) > 1 for index in indices]
+
+    # Get full file hashes
+    # Switch to processes once hashing becomes CPU bound
+    _uncached = [index for index in _candidates if index not in file_hashes and index not in _segmented]
+    _use_processes = sum(sizes[index] for index in _uncached) > PROCESS_POOL_THRESHOLD
+    _uncached_hashes = get_hashes([paths[index] for index in _uncached], _workers=_workers,
+                                  _use_processes=_use_processes)
+
+    # Hash segmented files one at a time outside the pools so their segments get the whole worker budget
+    _uncached_segmented = [index for index in _candidates if index not in file_hashes and index in _segmented]
+    if _uncached_segmented:
+        segment_workers = _workers or os.cpu_count() or 1
+        for index in progressBar(_uncached_segmented, prefix='Getting Segmented File Hashes:', suffix='Complete',
+                                 length=50):
+            _uncached.append(index)
+            _uncached_hashes.append(get_segmented_hash(paths[index], sizes[index], segment_workers))
+    file_hashes.update(zip(_uncached, _uncached_hashes))
+    for index in _candidates:
+        hash_dict[file_hashes[index]].append(paths[index])
+
+    # Store newly computed hashes
+    if cache is not None:
+        try:
+            cache.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                              [(cache_keys[index], sizes[index], mtimes[index], HASH_ALGORITHM, file_hash)
+                               for index, file_hash in zip(_uncached, _uncached_hashes)])
+        except sqlite3.Error as error:
+            print(RED_BOLD_ANSI + CACHE_UNAVAILABLE_MSG.format(error) + STOP_ESCAPE_ANSI)
+        cache.close()
+    if _use_xattr:
+        for index, file_hash in zip(_uncached, _uncached_hashes):
+            set_xattr_hash(paths[index], mtimes[index], file_hash)
+
     # Filter duplicate files
     _duplicate_files = [files for files in progressBar(hash_dict.values(),
                                                        prefix='Filtering Duplicate Files:',
@@ -157,30 +729,57 @@ def get_duplicates(_file_entries: list[os.DirEntry]):
 def remove_duplicates_files(_duplicate_files, _prompt_flag):
     """
     Remove all duplicate files except for the first index
-    :param _duplicate_files: list[str]
+    :param _duplicate_files: list[list[str]]
     :param _prompt_flag: bool
+    :return: list[str], removed files
     """
-    # Iterate through the different duplicate files
-    for duplicates in progressBar(_duplicate_files, prefix='Deleting Duplicate Files:', suffix='Complete', length=50):
-        # Iterate through the duplicate files
-        for file_path in duplicates[1:]:
+    _file_paths = [file_path for duplicates in _duplicate_files for file_path in duplicates[1:]]
+    if _prompt_flag:
+        _file_paths = confirm_files(_file_paths)
+    return remove_files(_file_paths, 'Deleting Duplicate Files:')
 
-            if _prompt_flag:
-                # Prompt user for confirmation
-                res = input(DELETE_CONFIRMATION_MSG.format(BLUE_BOLD_UNDERLINE_ANSI + file_path + STOP_ESCAPE_ANSI))
-                while res not in ['y', 'n']:
-                    # Check for valid reply
-                    res = input(DELETE_CONFIRMATION_MSG.format(BLUE_BOLD_UNDERLINE_ANSI + file_path + STOP_ESCAPE_ANSI))
 
-                if res == 'y':
-                    os.remove(file_path)
-                    print(SUCCESSFULLY_REMOVED_MSG.format(file_path))
-                else:
-                    print(CANCELLED_BY_USER_MSG.format(file_path))
-
-            else:
-                os.remove(file_path)
-                print(SUCCESSFULLY_REMOVED_MSG.format(file_path))
+def link_duplicates_files(_duplicate_files, _prompt_flag):
+    """
+    Replace duplicate files with hardlinks to the first index on the same filesystem. Files whose permissions or
+    owner differ from the linked file are kept, since the hardlink would change them
+    :param _duplicate_files: list[list[str]]
+    :param _prompt_flag: bool
+    :return: list[str], replaced files
+    """
+    _links = []
+    for duplicates in _duplicate_files:
+        # The first file on each filesystem is the one the others on it are linked to
+        source_stats = {}
+        for file_path in duplicates:
+            try:
+                file_stat = os.stat(file_path)
+            except OSError as error:
+                print(RED_BOLD_ANSI + FAILED_TO_LINK_MSG.format(file_path, error) + STOP_ESCAPE_ANSI)
+                continue
+
+            source = source_stats.get(file_stat.st_dev)
+            if source is None:
+                if source_stats:
+                    print(DIFFERENT_FILESYSTEM_MSG.format(file_path))
+                source_stats[file_stat.st_dev] = (file_path, file_stat)
+                continue
+
+            source_path, source_stat = source
+            if file_stat.st_ino == source_stat.st_ino:
+                # Skip files that are already hardlinked
+                continue
+            if (file_stat.st_mode, file_stat.st_uid, file_stat.st_gid) != \
+                    (source_stat.st_mode, source_stat.st_uid, source_stat.st_gid):
+                print(DIFFERENT_METADATA_MSG.format(file_path))
+                continue
+            _links.append((source_path, file_path))
+
+    if _prompt_flag:
+        _confirmed_paths = set(confirm_files([file_path for _, file_path in _links], LINK_CONFIRMATION_MSG,
+                                             LINK_CANCELLED_BY_USER_MSG))
+        _links = [(source_path, file_path) for source_path, file_path in _links if file_path in _confirmed_paths]
+    return link_files(_links, 'Linking Duplicate Files:')
 
 
 def remove_invalid_files(_invalid_files, _prompt_flag):
@@ -188,25 +787,11 @@ def remove_invalid_files(_invalid_files, _prompt_flag):
     Remove all files with no file sizes
     :param _invalid_files: list[str]
     :param _prompt_flag: bool
-    :return: bool
     """
-    for file_path in progressBar(_invalid_files, prefix='Deleting Invalid Files:', suffix='Complete', length=50):
-        if _prompt_flag:
-            # Prompt user for confirmation
-            res = input(DELETE_CONFIRMATION_MSG.format(BLUE_BOLD_UNDERLINE_ANSI + file_path + STOP_ESCAPE_ANSI))
-            while res not in ['y', 'n']:
-                # Check for valid reply
-                res = input(DELETE_CONFIRMATION_MSG.format(BLUE_BOLD_UNDERLINE_ANSI + file_path + STOP_ESCAPE_ANSI))
-
-            if res == 'y':
-                os.remove(file_path)
-                print(SUCCESSFULLY_REMOVED_MSG.format(file_path))
-            else:
-                print(CANCELLED_BY_USER_MSG.format(file_path))
-
-        else:
-            os.remove(file_path)
-            print(SUCCESSFULLY_REMOVED_MSG.format(file_path))
+    _file_paths = _invalid_files
+    if _prompt_flag:
+        _file_paths = confirm_files(_file_paths)
+    remove_files(_file_paths, 'Deleting Invalid Files:')
 
 
 if __name__ == '__main__':
@@ -215,20 +800,34 @@ if __name__ == '__main__':
     directory = args.directory
     recursive_flag = args.recursive
     prompt_flag = args.confirmation
+    hardlink_flag = args.hardlink
     remove_invalid_file_flag = args.invalid_files
+    workers = args.workers
+    cache_path = os.path.join(directory, CACHE_FILE_NAME) if args.cache else None
+    xattr_flag = args.xattr and hasattr(os, 'setxattr')
     if not valid_arguments(directory):
         exit(1)
 
     # Get files
-    file_entries = get_files(directory, recursive_flag)
-    invalid_files, duplicate_files = get_duplicates(file_entries)
-
-    # Delete Duplicate Files
-    if duplicate_files:
+    # Skip the hash cache and its journal files
+    cache_files = {cache_path + suffix for suffix in CACHE_FILE_SUFFIXES} if cache_path else set()
+    file_entries = (entry for entry in iter_files(directory, recursive_flag) if entry.path not in cache_files)
+    invalid_files, duplicate_files = get_duplicates(file_entries, workers, cache_path, xattr_flag)
+
+    # Delete or Link Duplicate Files
+    if duplicate_files and hardlink_flag:
+        print(LINKING_DUPLICATE_FILES_MSG)
+        changed_files = link_duplicates_files(duplicate_files, prompt_flag)
+    elif duplicate_files:
         print(REMOVING_DUPLICATE_FILES_MSG)
-        remove_duplicates_files(duplicate_files, prompt_flag)
+        changed_files = remove_duplicates_files(duplicate_files, prompt_flag)
     else:
         print(NO_DUPLICATES_MSG)
+        changed_files = []
+
+    # Drop cached hashes of files that no longer exist or now share the kept file's content
+    if cache_path:
+        prune_hash_cache(cache_path, changed_files)
 
     # Delete Invalid Files
     if remove_invalid_file_flag:
@@ -236,6 +835,6 @@ if __name__ == '__main__':
         remove_invalid_files(invalid_files, prompt_flag)
     elif invalid_files:
         print(INVALID_FILES_DETECTED_MSG)
-        [print(file_path) for file_path in invalid_files]
+        sys.stdout.write('\n'.join(invalid_files) + '\n')
 
     print('Operation Completed')
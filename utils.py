@@ -1,5 +1,11 @@
+import time
+
+# Maximum progress bar redraws per second
+REFRESH_RATE = 30
+
+
 # Print iterations progress
-def progressBar(iterable, prefix='', suffix='', decimals=1, length=100, fill='█', printEnd="\r"):
+def progressBar(iterable, prefix='', suffix='', decimals=1, length=100, fill='█', printEnd="\r", total=None):
     """
     Call in a loop to create terminal progress bar
     @params:
@@ -10,21 +16,29 @@ def progressBar(iterable, prefix='', suffix='', decimals=1, length=100, fill='
         length      - Optional  : character length of bar (Int)
         fill        - Optional  : bar fill character (Str)
         printEnd    - Optional  : end character (e.g. "\r", "\r\n") (Str)
+        total       - Optional  : number of items, required if iterable has no len() (Int)
     """
-    total = len(iterable)
+    if total is None:
+        total = len(iterable)
 
     # Progress Bar Printing Function
     def printProgressBar(iteration):
-        percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-        filledLength = int(length * iteration // total)
+        # Treat an empty iterable as already complete
+        fraction = iteration / float(total) if total else 1.0
+        percent = ("{0:." + str(decimals) + "f}").format(100 * fraction)
+        filledLength = int(length * fraction)
         bar = fill * filledLength + '-' * (length - filledLength)
         print(f'\r{prefix} |{bar}| {percent}% {suffix}', end=printEnd)
 
     # Initial Call
     printProgressBar(0)
-    # Update Progress Bar
+    last_print = time.monotonic()
+    # Update Progress Bar, throttled except for the final iteration
     for i, item in enumerate(iterable):
         yield item
-        printProgressBar(i + 1)
+        now = time.monotonic()
+        if now - last_print >= 1 / REFRESH_RATE or i + 1 == total:
+            printProgressBar(i + 1)
+            last_print = now
     # Print New Line on Complete
     print()